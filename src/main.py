@@ -3,13 +3,15 @@ main.py - Gmail MCP Serverエントリーポイント
 """
 from dotenv import load_dotenv
 
-from server import create_server, init_gmail_credentials
-
 # 環境変数のロード
 load_dotenv()
 
 def main():
     """メイン実行関数"""
+    # HTMLパース用の spawn ワーカーは本モジュールを __mp_main__ として読み込むため、
+    # サーバー一式の import はワーカーに波及しないよう関数内で行う
+    from server import create_server, init_gmail_credentials
+
     # Gmail認証
     init_gmail_credentials()
     
@@ -17,25 +17,23 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 CREDENTIALS_DIR = BASE_DIR / "credentials"
 OAUTH_KEYS = os.getenv("GMAIL_OAUTH_PATH", str(CREDENTIALS_DIR / "client_secret_gmail_oauth.json"))
 CRED_PATH = os.getenv("GMAIL_CREDENTIALS_PATH", str(CREDENTIALS_DIR / "credentials.json"))
+STATE_PATH = os.getenv("GMAIL_STATE_PATH", str(CREDENTIALS_DIR / "state.db"))
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]
 
+# MCP サーバーに登録するツール
+TOOLS = (
+    send_email, create_draft, read_email, search_emails, delete_email,
+    modify_label, create_label_tool, delete_label_tool, list_labels_tool,
+    get_or_create_label_tool, update_label_tool, find_label_by_name_tool,
+)
+
 def create_server() -> FastMCP:
     """MCP サーバーの作成とツール登録"""
     server = FastMCP("gmail", version="1.0.1")
     
     # ツール登録
-    server.tool()(send_email)
-    server.tool()(create_draft)
-    server.tool()(read_email)
-    server.tool()(search_emails)
-    server.tool()(delete_email)
-    server.tool()(modify_label)
-    server.tool()(create_label_tool)
-    server.tool()(delete_label_tool)
-    server.tool()(list_labels_tool)
-    server.tool()(get_or_create_label_tool)
-    server.tool()(update_label_tool)
-    server.tool()(find_label_by_name_tool)
+    for tool in TOOLS:
+        server.tool()(tool)
     
     return server
 
@@ -45,5 +43,6 @@ def init_gmail_credentials():
         config_path=BASE_DIR,
         cred_path=CRED_PATH,
         oauth_path=OAUTH_KEYS,
-        scopes=SCOPES
+        scopes=SCOPES,
+        state_path=STATE_PATH
     )
\ No newline at end of file
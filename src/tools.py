@@ -2,10 +2,17 @@
 tools.py - Gmail操作のためのツール定義
 メール送信・下書き・読み取り・検索・修正・削除およびラベル管理機能また、ラベル操作関連のツール定義を提供
 """
+import asyncio
 import base64
-import json
-from typing import Dict, Any, Tuple, List
-from bs4 import BeautifulSoup
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Tuple, List, Optional
+from cachetools import TTLCache
+import orjson
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
 
 # Utilities
 from utils.label_manager import (
@@ -13,8 +20,36 @@ from utils.label_manager import (
     list_labels, find_label_by_name, get_or_create_label
 )
 import utils.gmail_utils as gmail_utils
+from utils.html_text import extract_html_text
 from utils.utils import decode_base64url
 
+# Gmail API のバッチリクエスト1回あたりの上限件数
+_BATCH_SIZE = 100
+# batchDelete / batchModify の1リクエストあたりの上限件数
+_BULK_SIZE = 1000
+# この文字数以上のHTMLはプロセスプールでパースする(小さい本文はプロセス間通信のコストの方が大きい)
+_PROCESS_PARSE_THRESHOLD = 8 * 1024
+# read_email のページング用に抽出済み本文をメッセージIDごとに保持 (最大64件, 5分)
+_body_cache: "TTLCache[str, Tuple[str, str]]" = TTLCache(maxsize=64, ttl=300)
+
+
+def _new_parse_pool() -> ProcessPoolExecutor:
+    """HTMLパース用のプロセスプールを作成する(ワーカーは最初の投入時に起動される)"""
+    # スレッドを持つプロセスからの fork を避けるため spawn で起動する
+    return ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+
+
+# HTMLパース用のプロセスプール
+_PARSE_POOL = _new_parse_pool()
+# プールの作り直しを1回にまとめるためのロック
+_PARSE_POOL_LOCK = threading.Lock()
+
+
+def _raw_b64url(data: bytes) -> str:
+    """MIMEメールのバイト列をGmail APIのraw形式(パディングなしBase64URL)に変換する"""
+    # パディング除去はバイト列のまま行い、ASCIIとしてデコードする
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
 
 # --- Tools: Email操作 ---
 async def send_email(args: Dict[str, Any]) -> str:
@@ -43,16 +78,18 @@ async def send_email(args: Dict[str, Any]) -> str:
         "bcc": args.get("bcc"),                 # bcc(任意)
         "in_reply_to": args.get("in_reply_to"), # 返信元のメッセージID(任意)
         "attachments": args.get("attachments"),  # 添付ファイル(任意)
-    }).encode("utf-8")
+    })
     # メッセージをBase64でエンコード
-    raw = base64.urlsafe_b64encode(msg).decode().rstrip("=")
+    raw = _raw_b64url(msg)
     # payloadとは、メッセージのデータを含む辞書
     payload: Dict[str, Any] = {"raw": raw}
     # スレッドIDが指定されている場合は、スレッドIDを設定
     if "threadid" in args:
         payload["threadId"] = args["threadid"]
     # メッセージを送信
-    resp = gmail_utils.service.users().messages().send(userId="me", body=payload).execute()
+    resp = await asyncio.to_thread(
+        gmail_utils.service.users().messages().send(userId="me", body=payload).execute
+    )
     return f"Email sent: {resp.get('id')}"
 
 
@@ -82,16 +119,77 @@ async def create_draft(args: Dict[str, Any]) -> str:
         "bcc": args.get("bcc"),
         "in_reply_to": args.get("in_reply_to"),
         "attachments": args.get("attachments"),
-    }).encode("utf-8")
-    raw = base64.urlsafe_b64encode(msg).decode().rstrip("=")
+    })
+    raw = _raw_b64url(msg)
     # 下書きを作成
-    draft = gmail_utils.service.users().drafts().create(
-        userId="me", 
-        body={"message": {"raw": raw, "threadId": args.get("threadid")}}
-        ).execute()
+    draft = await asyncio.to_thread(
+        gmail_utils.service.users().drafts().create(
+            userId="me", 
+            body={"message": {"raw": raw, "threadId": args.get("threadid")}}
+        ).execute
+    )
     return f"Draft created: {draft.get('id')}"
 
 
+def _parse_html_in_process(content: str) -> str:
+    """プロセスプールでHTMLをパースする。プールが壊れていたら作り直し、このスレッドでパースする"""
+    global _PARSE_POOL
+    pool = _PARSE_POOL
+    try:
+        return pool.submit(extract_html_text, content).result()
+    except BrokenProcessPool:
+        # ワーカーが異常終了するとプールは以降すべての投入を拒否するため、新しいプールに差し替える
+        with _PARSE_POOL_LOCK:
+            if _PARSE_POOL is pool:
+                _PARSE_POOL = _new_parse_pool()
+        pool.shutdown(wait=False)
+        return extract_html_text(content)
+
+
+def extract_email_body(payload: Dict[str, Any]) -> Tuple[str, str]:
+    """メールの本文を取得する"""
+    text_parts: List[str] = []
+    html_parts: List[str] = []
+    # メール本文はネストされてる可能性があるため、スタックで深さ優先に走査
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+
+        mime = part.get("mimeType")
+        data = part.get("body", {}).get("data")
+        # 本文以外(画像など)のパートはデコードせずに読み飛ばす
+        if data and mime in ("text/plain", "text/html"):
+            # メールの本文をBase64でURL-safeエンコードからUTF-8の文字列に変換
+            content = decode_base64url(data)
+            if mime == "text/plain": text_parts.append(content)
+            elif len(content) < _PROCESS_PARSE_THRESHOLD:
+                html_parts.append(extract_html_text(content))
+            else:
+                # 大きなHTMLはGILの影響を受けないよう別プロセスでパースする
+                html_parts.append(_parse_html_in_process(content))
+
+        # 元の順序で処理されるよう逆順に積む
+        stack.extend(reversed(part.get("parts", [])))
+    return "".join(text_parts), "".join(html_parts)
+
+
+async def _load_email_body(message_id: str) -> Tuple[str, str]:
+    """メールを取得して本文(text, html)を抽出する。ページング読み取り用に結果をキャッシュする"""
+    cached = _body_cache.get(message_id)
+    if cached is not None:
+        return cached
+
+    # メッセージを取得
+    msg = await asyncio.to_thread(
+        gmail_utils.service.users().messages().get(userId="me", id=message_id, format="full").execute
+    )
+
+    # HTMLのパースはCPU負荷が高いため、イベントループを止めないようワーカースレッドで実行
+    body = await asyncio.to_thread(extract_email_body, msg["payload"])
+    _body_cache[message_id] = body
+    return body
+
+
 async def read_email(args: Dict[str, Any]) -> str:
     """
     指定されたメッセージIDのメールを取得し、本文を抽出して返します。
@@ -109,29 +207,7 @@ async def read_email(args: Dict[str, Any]) -> str:
             - truncated (bool): HTML本文が切り取られているかどうか。
             - nextOffset (int or None): 次の読み取り開始位置。全文が取得済みの場合はNone。
     """
-    # メッセージを取得
-    msg = gmail_utils.service.users().messages().get(userId="me", id=args["messageid"], format="full").execute()
-
-    def extract_email_body(part: Dict[str, Any]) -> Tuple[str, str]:
-        """メールの本文を取得する"""
-        text, html = "", ""
-
-        if "data" in part.get("body", {}):
-            # メールの本文をBase64でURL-safeエンコードからUTF-8の文字列に変換
-            content = decode_base64url(part["body"]["data"])
-            if part.get("mimeType") == "text/plain": text = content
-            elif part.get("mimeType") == "text/html": 
-                # HTMLをパースして本文っぽい要素だけ残す
-                soup = BeautifulSoup(content, "html.parser")
-                main_texts = [p.get_text(strip=True) for p in soup.find_all(["p", "div"])]
-                html = "\n".join(main_texts)
-
-        for sub in part.get("parts", []):
-            # メール本文はネストされてる可能性があるため、再帰的にメールの本文を取得
-            t, h = extract_email_body(sub); text += t; html += h
-        return text, html
-    
-    text, html = extract_email_body(msg["payload"])
+    text, html = await _load_email_body(args["messageid"])
 
     # クライアントから指定できるオプション
     limit = args.get("htmlLimit", 10_000)  # 1チャンクあたりの最大文字数
@@ -141,12 +217,71 @@ async def read_email(args: Dict[str, Any]) -> str:
     html_chunks = html[offset: offset + limit] 
     truncated = len(html) > offset + limit
 
-    return json.dumps({
+    # orjson は非ASCII文字をそのままUTF-8で出力する (ensure_ascii=False 相当)
+    return orjson.dumps({
         "text": text,
         "html": html_chunks,
         "truncated": truncated,  # 次チャンクがあるかどうか
         "nextOffset": offset + limit if truncated else None
-    }, ensure_ascii=False)
+    }).decode("utf-8")
+
+
+def _metadata_request(service: Resource, msg_id: str):
+    """search_emails で使うメタデータ取得リクエストを作成する"""
+    return service.users().messages().get(
+        userId="me",
+        id=msg_id,
+        format="metadata",
+        metadataHeaders=["Subject", "From", "Date"],
+        # 使うフィールドだけ返させてレスポンスを小さくする
+        fields="id,threadId,payload/headers"
+    )
+
+
+def _parse_metadata(response: Dict[str, Any]) -> Dict[str, Any]:
+    """メタデータ取得レスポンスから ID とヘッダ情報を取り出す"""
+    # 取得するヘッダは3つだけなので、辞書を作らず1回の走査で直接拾う
+    subject = sender = date = ""
+    for h in response["payload"]["headers"]:
+        name = h["name"]
+        if name == "Subject": subject = h["value"]
+        elif name == "From": sender = h["value"]
+        elif name == "Date": date = h["value"]
+    return {
+        "id": response["id"],
+        "threadId": response.get("threadId"),
+        "Subject": subject,
+        "From": sender,
+        "Date": date,
+    }
+
+
+async def _fetch_metadata_chunk(service: Resource, ids: List[str]) -> List[Dict[str, Any]]:
+    """最大100件のIDについてメタデータをバッチ取得する"""
+    # request_id にIDの位置を使い、コールバックの到着順によらず list() の順序で格納する
+    results: List[Optional[Dict[str, Any]]] = [None] * len(ids)
+    batch = service.new_batch_http_request()
+    def _collect(request_id, response, exception):
+        if exception:
+            # 個別失敗は飛ばす
+            return
+        results[int(request_id)] = _parse_metadata(response)
+
+    for i, msg_id in enumerate(ids):
+        batch.add(_metadata_request(service, msg_id), callback=_collect, request_id=str(i))
+    try:
+        await asyncio.to_thread(batch.execute)
+    except HttpError as e:
+        # バッチエンドポイント自体が拒否された場合(400/503)は個別リクエストを並行実行する
+        if e.status_code not in (400, 503):
+            raise
+        responses = await asyncio.gather(
+            *(asyncio.to_thread(_metadata_request(service, msg_id).execute) for msg_id in ids),
+            return_exceptions=True
+        )
+        # 個別失敗は飛ばす
+        return [_parse_metadata(r) for r in responses if not isinstance(r, Exception)]
+    return [r for r in results if r is not None]
 
 
 async def search_emails(args: Dict[str, Any]) -> Dict[str, Any]:
@@ -182,44 +317,23 @@ async def search_emails(args: Dict[str, Any]) -> Dict[str, Any]:
     page_token = args.get("pageToken")
 
     # list API を叩く
-    list_params = {"userId": "me", "maxResults": max_results}
+    # ID と次ページトークン以外は使わないので fields で絞る
+    list_params = {"userId": "me", "maxResults": max_results, "fields": "messages/id,nextPageToken"}
     if query:
         list_params["q"] = query
     if page_token:
         list_params["pageToken"] = page_token
 
-    resp = service.users().messages().list(**list_params).execute()
+    resp = await asyncio.to_thread(service.users().messages().list(**list_params).execute)
     ids = [m["id"] for m in resp.get("messages", [])]
     next_token = resp.get("nextPageToken")
 
-    # メタデータだけ一括取得するバッチリクエスト
-    results: List[Dict[str, Any]] = []
-    if ids:
-        batch = service.new_batch_http_request()
-        def _collect(request_id, response, exception):
-            if exception:
-                # 個別失敗は飛ばす
-                return
-            hdrs = {h["name"]: h["value"] for h in response["payload"]["headers"]}
-            results.append({
-                "id": response["id"],
-                "threadId": response.get("threadId"),
-                "Subject": hdrs.get("Subject", ""),
-                "From": hdrs.get("From", ""),
-                "Date": hdrs.get("Date", ""),
-            })
-
-        for msg_id in ids:
-            batch.add(
-                service.users().messages().get(
-                    userId="me",
-                    id=msg_id,
-                    format="metadata",
-                    metadataHeaders=["Subject", "From", "Date"]
-                ),
-                callback=_collect
-            )
-        batch.execute()
+    # メタデータだけ一括取得するバッチリクエスト(1バッチ100件までのため分割して並行実行)
+    chunks = await asyncio.gather(*(
+        _fetch_metadata_chunk(service, ids[i:i + _BATCH_SIZE])
+        for i in range(0, len(ids), _BATCH_SIZE)
+    ))
+    results = [m for chunk in chunks for m in chunk]
 
     return {
         "messages": results,
@@ -229,27 +343,62 @@ async def search_emails(args: Dict[str, Any]) -> Dict[str, Any]:
 
 async def delete_email(args: Dict[str, Any]) -> str:
     """
-    指定メッセージIDのメールを削除します。
+    指定メッセージIDのメールを削除します。複数IDを渡した場合は batchDelete で一括削除します。
 
     Args:
         args (Dict[str, Any]):
-            - messageid (str): 削除対象のメッセージID。
+            - messageid (str, optional): 削除対象のメッセージID。
+            - messageids (List[str], optional): 削除対象のメッセージIDリスト(一括削除)。
 
     Returns:
         str: 削除結果メッセージ (例"Email deleted: メッセージID").
     """
-    gmail_utils.service.users().messages().delete(userId="me", id=args["messageid"]).execute()
+    message_ids = args.get("messageids")
+    if isinstance(message_ids, list):
+        # batchDelete は1リクエスト1000件までのため分割して送る
+        for i in range(0, len(message_ids), _BULK_SIZE):
+            await asyncio.to_thread(
+                gmail_utils.service.users().messages().batchDelete(
+                    userId="me",
+                    body={"ids": message_ids[i:i + _BULK_SIZE]}
+                ).execute
+            )
+        for msg_id in message_ids:
+            _body_cache.pop(msg_id, None)
+        return f"Emails deleted: {len(message_ids)}"
+
+    await asyncio.to_thread(
+        gmail_utils.service.users().messages().delete(userId="me", id=args["messageid"]).execute
+    )
+    _body_cache.pop(args["messageid"], None)
     return f"Email deleted: {args['messageid']}"
 
 
 # --- Tools: ラベル操作 ---
+async def _update_label_by_name(name: str, label_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ラベル索引から解決したIDでラベルを更新する
+    索引の有効期間内に外部で削除・再作成された可能性があるため、失敗した場合は
+    一覧を取り直して別のIDに解決できたときだけ1回再試行する
+    """
+    try:
+        return await asyncio.to_thread(update_label, gmail_utils.service, label_id, updates)
+    except ValueError:
+        fresh = await asyncio.to_thread(find_label_by_name, gmail_utils.service, name, True)
+        if not fresh or fresh.id == label_id:
+            # 同じIDなら古い索引が原因ではないので、元のエラーをそのまま返す
+            raise
+        return await asyncio.to_thread(update_label, gmail_utils.service, fresh.id, updates)
+
+
 async def modify_label(args: Dict[str, Any]) -> str:
     """
-    メッセージIDを受け取り該当のメールにラベルを追加または削除します。
+    メッセージIDを受け取り該当のメールにラベルを追加または削除します。複数IDを渡した場合は batchModify で一括変更します。
 
     Args:
         args (Dict[str, Any]):
-            - messageid (str): 対象メッセージID。
+            - messageid (str, optional): 対象メッセージID。
+            - messageids (List[str], optional): 対象メッセージIDリスト(一括変更)。
             - addLabelIds (List[str], optional): 追加するラベルIDリスト。
             - removeLabelIds (List[str], optional): 削除するラベルIDリスト。
 
@@ -260,12 +409,26 @@ async def modify_label(args: Dict[str, Any]) -> str:
     # 必要なパラメータだけ動的にbodyに追加
     if "addLabelIds" in args: body["addLabelIds"] = args["addLabelIds"]
     if "removeLabelIds" in args: body["removeLabelIds"] = args["removeLabelIds"]
+    message_ids = args.get("messageids")
+    if isinstance(message_ids, list):
+        # batchModify は1リクエスト1000件までのため分割して送る
+        for i in range(0, len(message_ids), _BULK_SIZE):
+            await asyncio.to_thread(
+                gmail_utils.service.users().messages().batchModify(
+                    userId="me",
+                    body={"ids": message_ids[i:i + _BULK_SIZE], **body}
+                ).execute
+            )
+        return f"Labels modified: {len(message_ids)}"
+
     # bodyのキーを解析し、指定したラベルIDを追加・削除
-    gmail_utils.service.users().messages().modify(
-        userId="me",
-        id=args["messageid"],
-        body=body
-    ).execute()
+    await asyncio.to_thread(
+        gmail_utils.service.users().messages().modify(
+            userId="me",
+            id=args["messageid"],
+            body=body
+        ).execute
+    )
     return f"Label modified: {args['messageid']}"
 
 
@@ -282,7 +445,8 @@ async def create_label_tool(args: Dict[str, Any]) -> str:
     Returns:
         str: 作成結果メッセージ。
     """
-    lbl = create_label(
+    lbl = await asyncio.to_thread(
+        create_label,
         gmail_utils.service,
         args["name"],
         args.get("messageListVisibility", "show"),
@@ -302,11 +466,12 @@ async def delete_label_tool(args: Dict[str, Any]) -> str:
     Returns:
         str: 削除結果メッセージ。
     """
-    label = find_label_by_name(gmail_utils.service, args["name"])
+    # 索引が古いと名前変更後の別ラベルを削除しかねないため、削除前は必ず一覧を取り直して確認する
+    label = await asyncio.to_thread(find_label_by_name, gmail_utils.service, args["name"], True)
     if not label:
         raise ValueError(f"Label '{args['name']}' not found")
     
-    result = delete_label(gmail_utils.service, label.id)
+    result = await asyncio.to_thread(delete_label, gmail_utils.service, label.id)
     return result["message"]
 
 
@@ -320,7 +485,7 @@ async def list_labels_tool() -> str:
     Returns:
         str: ラベル名(ID)とタイプ一覧を改行区切りで返す。
     """
-    lbls = list_labels(gmail_utils.service)
+    lbls = await asyncio.to_thread(list_labels, gmail_utils.service)
     lines = [f"{l['name']} (ID: {l['id']}), Type: {l['type']}" for l in lbls["all"]]
     return "\n".join(lines)
 
@@ -338,7 +503,8 @@ async def get_or_create_label_tool(args: Dict[str, Any]) -> str:
     Returns:
         str: 準備完了メッセージ。
     """
-    lbl = get_or_create_label(
+    lbl = await asyncio.to_thread(
+        get_or_create_label,
         gmail_utils.service, args["name"],
         args.get("messageListVisibility", "show"),
         args.get("labelListVisibility", "labelShow")
@@ -376,10 +542,9 @@ async def update_label_tool(args: Dict[str, Any]) -> str:
     if not name:
         raise ValueError("Missing required argument: 'name'")
 
-    label = find_label_by_name(gmail_utils.service, name)
+    label = await asyncio.to_thread(find_label_by_name, gmail_utils.service, name)
     if not label:
         raise ValueError(f"Label '{name}' not found")
-    label_id = label.id
 
     # 3) updates の取り出し
     raw_updates = params.get("updates")
@@ -422,7 +587,7 @@ async def update_label_tool(args: Dict[str, Any]) -> str:
 
     # 5) 実際に更新
     try:
-        updated = update_label(gmail_utils.service, label_id, updates)
+        updated = await _update_label_by_name(name, label.id, updates)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -443,5 +608,5 @@ async def find_label_by_name_tool(args: Dict[str, Any]) -> str:
     Returns:
         str: 検索結果メッセージ。
     """
-    lbl = find_label_by_name(gmail_utils.service, args["name"])
+    lbl = await asyncio.to_thread(find_label_by_name, gmail_utils.service, args["name"])
     return f"Label found: {lbl.id}: {lbl.name}"
\ No newline at end of file
@@ -1,33 +1,112 @@
-import re
 import os
 import base64
+import json
 import mimetypes
-from typing import List, Dict, Any, Optional
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import queue
+import secrets
+import stat
+import threading
+from typing import List, Dict, Any, Optional, Tuple, BinaryIO, Deque
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import encode_rfc2231
+from functools import lru_cache
 
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build, Resource
+from googleapiclient.discovery import build_from_document, Resource
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+from utils import state_store
 
 
 service: Optional[Resource] = None
 
-def load_credentials(config_path: str, cred_path: str, oauth_path: str, scopes: List[str]) -> None:
+# 添付ファイルを読み込む単位(57バイト = Base64の1行76文字分)
+_ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# 添付ファイルを開く際のフラグ
+# O_NONBLOCK: FIFO などを開いた際に open 自体がブロックしないようにする(Windows には存在しない)
+# O_BINARY: Windows で改行変換を行わせない(Windows 以外には存在しない)
+_ATTACHMENT_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_NONBLOCK", 0) | getattr(os, "O_BINARY", 0)
+
+# プレーンテキストメールの固定ヘッダ
+_PLAIN_TEXT_HEADERS = (
+    "Content-Type: text/plain; charset=UTF-8",
+    "Content-Transfer-Encoding: 7bit",
+)
+
+
+# 同時に保持するHTTP接続数(想定するツール同時実行数以上にしておく)
+_HTTP_POOL_SIZE = 20
+
+
+class _PooledHttp:
+    """
+    AuthorizedHttp をプールして使い回すHTTPクライアント
+
+    httplib2.Http はスレッドセーフではないため1リクエストにつき1インスタンスを貸し出し、
+    返却後も keep-alive 接続を保持したまま再利用してTLSハンドシェイクを省く
+    """
+    def __init__(self, credentials: Credentials, size: int = _HTTP_POOL_SIZE):
+        self.credentials = credentials
+        # 直近に使った(接続が温まっている)インスタンスから再利用する
+        self._pool: "queue.LifoQueue[AuthorizedHttp]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def request(self, *args, **kwargs):
+        with self._slots:
+            try:
+                http = self._pool.get_nowait()
+            except queue.Empty:
+                # build_http: googleapiclient 既定のタイムアウト(60秒)とリダイレクト設定を持つ httplib2.Http
+                http = AuthorizedHttp(self.credentials, http=build_http())
+            try:
+                return http.request(*args, **kwargs)
+            finally:
+                self._pool.put(http)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _read_stored_credentials(cred_path: str, scopes: List[str], state_path: str) -> Optional[Credentials]:
+    """保存済みのトークン情報からCredentialsを作成する。なければNoneを返す"""
+    # トークン情報はSQLiteストアから読み込む。なければ従来のcredentials.jsonから移行する
+    token = state_store.load_token(state_path, scopes)
+    migrated = False
+    if token is None and os.path.exists(cred_path):
+        with open(cred_path) as f:
+            token = f.read()
+        migrated = True
+    if not token:
+        return None
+    try:
+        # トークン情報(JSON)からGoogle APIにアクセスできるCredentialsオブジェクトを作成
+        creds = Credentials.from_authorized_user_info(json.loads(token), scopes)
+    except ValueError:
+        if migrated:
+            os.remove(cred_path)
+        else:
+            state_store.delete_token(state_path, scopes)
+        return None
+    if migrated:
+        state_store.save_token(state_path, scopes, creds.to_json())
+    return creds
+
+
+def load_credentials(config_path: str, cred_path: str, oauth_path: str, scopes: List[str], state_path: str) -> None:
     """OAuth2.0 credentialsを読み込み/更新し、Gmail APIクライアントを初期化する"""
     # exist_ok=True: ディレクトリが存在しない場合は作成, Falseの場合はディレクトリが存在しない場合はエラー
     os.makedirs(config_path, exist_ok=True)
-    creds = None
-    if os.path.exists(cred_path):
-        try:
-        # cred_pathあるcredentias.jsonからGoogle APIにアクセスできるトークン情報を読み込んでCredentialsオブジェクトを作成
-            creds = Credentials.from_authorized_user_file(cred_path, scopes)
-        except ValueError:
-            os.remove(cred_path)
-            creds = None
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    creds = _read_stored_credentials(cred_path, scopes, state_path)
     if not creds or not creds.valid:
         # トークン情報がないか期限切れの場合は新しく作成
         if creds and creds.expired and creds.refresh_token:
@@ -38,11 +117,10 @@ def load_credentials(config_path: str, cred_path: str, oauth_path: str, scopes:
             flow = InstalledAppFlow.from_client_secrets_file(oauth_path, scopes)
             # 認証サーバーにアクセスして認証
             creds = flow.run_local_server(port=8080, access_type='offline', prompt='consent')
-        with open(cred_path, "w") as token:
-            token.write(creds.to_json())
+        state_store.save_token(state_path, scopes, creds.to_json())
     global service
-    service = build("gmail", "v1", credentials=creds)
-            
+    # ライブラリ同梱のディスカバリ文書からクライアントを構築し、起動時のディスカバリ取得(HTTPS)を行わない
+    service = build_from_document(get_static_doc("gmail", "v1"), http=_PooledHttp(creds))
 
 
 def encode_email_header(text: str) -> str:
@@ -50,9 +128,9 @@ def encode_email_header(text: str) -> str:
     RFC2047 に準拠して、非ASCII文字を含むヘッダをBase64でエンコードする
     """
     # 非 ASCII文字が含まれるかチェック
-    if re.search(r'[^\x00-\x7F]', text):
-        # Base64でエンコード
-        encoded = base64.b64encode(text.encode('utf-8')).decode('utf-8')
+    if not text.isascii():
+        # Base64でエンコード(結果は必ずASCII)
+        encoded = base64.b64encode(text.encode('utf-8')).decode('ascii')
         # エンコードした文字列をもとに、RFC2047の形式の文字列を作成
         return f"=?UTF-8?b?{encoded}?="
     return text
@@ -60,17 +138,81 @@ def encode_email_header(text: str) -> str:
 
 def validate_email(email: str) -> bool:
     """
-    簡易的な正規表現でメールアドレス形式をチェック
+    簡易的にメールアドレス形式をチェック(local@domain.tld の形か)
     完全網羅はしてないが、基本的な検証には有用
+    正規表現を使わず、文字列操作だけで判定する
     """
-    email_regex = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
-    return bool(email_regex.match(email))
+    local, at, domain = email.partition("@")
+    if not at or not local or not domain or "@" in domain:
+        return False
+    if any(c.isspace() for c in email):
+        return False
+    # ドメインの先頭・末尾以外に "." が必要
+    return "." in domain[1:-1]
+
+
+@lru_cache(maxsize=256)
+def _guess_ctype(ext: str) -> str:
+    """拡張子からMIMEタイプを推定する(同じ拡張子の結果はキャッシュする)"""
+    ctype, _ = mimetypes.guess_type("x" + ext)
+    return ctype or "application/octet-stream"
 
 
-def create_email_message(args: Dict[str, Any]) -> str:
+def _write_base64_payload(buf: bytearray, f: BinaryIO) -> None:
+    """
+    ファイルをチャンク単位で読みながらBase64(76文字ごとにCRLF改行)にエンコードしてbufに書き込む
+    ファイル全体を一度に読み込まないため、大きな添付ファイルでもメモリ使用量を抑えられる
+    """
+    while True:
+        data = f.read(_ATTACHMENT_CHUNK_SIZE)
+        if not data:
+            break
+        # チャンクは57バイトの倍数なので、チャンクごとにエンコードしても行の区切りは変わらない
+        buf += base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+
+def _open_attachment(path: str) -> Tuple[BinaryIO, int]:
+    """添付ファイルを開き、ファイルオブジェクトとサイズを返す"""
+    if not isinstance(path, str):
+        raise ValueError(f"Attachment not found: {path}")
+    try:
+        fd = os.open(path, _ATTACHMENT_OPEN_FLAGS)
+    except (FileNotFoundError, IsADirectoryError):
+        raise ValueError(f"Attachment not found: {path}")
+    except OSError:
+        raise ValueError(f"Cannot access attachment: {path}")
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        raise ValueError(f"Attachment not found: {path}")
+    # 通常ファイルの読み込みは O_NONBLOCK の影響を受けない
+    return os.fdopen(fd, 'rb'), st.st_size
+
+
+def _write_attachment_header(buf: bytearray, delimiter: bytes, path: str) -> None:
+    """添付ファイルパートの区切りとヘッダをbufに書き込む"""
+    ctype = _guess_ctype(os.path.splitext(path)[1].lower())
+    # RFC2231 形式でUTF-8ファイル名を付与
+    filename = encode_rfc2231(os.path.basename(path), "utf-8")
+    buf += delimiter
+    buf += (
+        f"Content-Type: {ctype}\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        f"Content-Disposition: attachment; filename*={filename}\r\n\r\n"
+    ).encode("ascii")
+
+
+def _encode_attachment(f: BinaryIO) -> bytearray:
+    """開いた添付ファイルを読み込み、Base64エンコードしたバイト列を返す"""
+    buf = bytearray()
+    _write_base64_payload(buf, f)
+    return buf
+
+
+def create_email_message(args: Dict[str, Any]) -> bytes:
     """
     引数で渡されたメール情報をもとに
-    SMTPで送信可能なMIMEメールを文字列で構築する
+    SMTPで送信可能なMIMEメールをバイト列で構築する
 
     args のキー:
         - from: 送信者アドレス (str)
@@ -83,87 +225,93 @@ def create_email_message(args: Dict[str, Any]) -> str:
         - attachments: 添付ファイルパスのリスト (Optional[List[str]])
 
     return:
-        - RFC 5322 形式のMIMEメール本文 (str)
+        - RFC 5322 形式のMIMEメール本文 (bytes)
     """
+    # 使う値は最初にまとめてローカル変数に取り出し、辞書の参照を1回にする
+    sender = args.get("from", "me")
+    to_list: List[str] = args.get("to", [])
+    cc = args.get("cc")
+    bcc = args.get("bcc")
+    in_reply_to = args.get("in_reply_to")
+    body = args.get("body", "")
+    attachments: Optional[List[str]] = args.get("attachments")
+
     # 件名をエンコード
     # args.get("subject", ""): argsという辞書の中からsubjectというキーの値を取得
     # もしsubjectがない場合は空文字を返す
     subject = encode_email_header(args.get("subject", ""))
 
-    # 受信者アドレス検証
-    to_list: List[str] = args.get("to", [])
-    for addr in to_list:
-        if not validate_email(addr):
-            raise ValueError(f"Invalid email address: {addr}")
+    # 受信者アドレス検証(不正なアドレスがある場合のみ、どれが不正かを探す)
+    if not all(validate_email(addr) for addr in to_list):
+        invalid = next(addr for addr in to_list if not validate_email(addr))
+        raise ValueError(f"Invalid email address: {invalid}")
 
-    attachments: Optional[List[str]] = args.get("attachments")
+    to_joined = ", ".join(to_list)
+
+    if attachments and not isinstance(attachments, list):
+        raise ValueError("'attachments' must be a list of file paths")
+
+    headers: List[str] = ["From: " + sender, "To: " + to_joined]
+    if cc:
+        headers.append("Cc: " + ", ".join(cc))
+    if bcc:
+        headers.append("Bcc: " + ", ".join(bcc))
+    headers.append("Subject: " + subject)
+    if in_reply_to:
+        headers += ("In-Reply-To: " + in_reply_to, "References: " + in_reply_to)
+    headers.append("MIME-Version: 1.0")
 
     # 添付ファイルなし: 従来どおりプレーンテキストを返す（後方互換）
     if not attachments:
-        headers: List[str] = []
-        headers.append(f"From: {args.get('from', 'me')}")
-        headers.append(f"To: {', '.join(to_list)}")
-        if args.get("cc"):
-            headers.append(f"Cc: {', '.join(args['cc'])}")
-        if args.get("bcc"):
-            headers.append(f"Bcc: {', '.join(args['bcc'])}")
-        headers.append(f"Subject: {subject}")
-        if args.get("in_reply_to"):
-            headers.append(f"In-Reply-To: {args['in_reply_to']}")
-            headers.append(f"References: {args['in_reply_to']}")
-        headers.append("MIME-Version: 1.0")
-        headers.append("Content-Type: text/plain; charset=UTF-8")
-        headers.append("Content-Transfer-Encoding: 7bit")
-
-        message = "\r\n".join(headers) + "\r\n\r\n" + args.get("body", "")
-        return message
-
-    # 添付ファイルあり: multipart/mixed を構築
-    if not isinstance(attachments, list):
-        raise ValueError("'attachments' must be a list of file paths")
+        headers += _PLAIN_TEXT_HEADERS
+        message = "\r\n".join(headers) + "\r\n\r\n" + body
+        return message.encode("utf-8")
+
+    # 添付ファイルあり: multipart/mixed (RFC 2046) の形式を email.mime を使わずに直接バイト列で組み立てる
+    boundary = secrets.token_hex(16)
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+    headers.append(f'Content-Type: multipart/mixed; boundary="{boundary}"')
+    buf = bytearray(("\r\n".join(headers) + "\r\n\r\n").encode("utf-8"))
+
+    # 本文パート
+    buf += delimiter
+    buf += b'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+    buf += base64.encodebytes(body.encode("utf-8")).replace(b"\n", b"\r\n")
 
-    # 合計サイズ上限（約24MB）チェック
+    # 合計サイズ上限（約24MB）は、添付ファイルを開いた際の fstat で累計してチェック
     total_bytes = 0
-    for path in attachments:
-        if not isinstance(path, str) or not os.path.isfile(path):
-            raise ValueError(f"Attachment not found: {path}")
-        try:
-            total_bytes += os.path.getsize(path)
-        except OSError:
-            raise ValueError(f"Cannot access attachment: {path}")
     max_bytes = 24 * 1024 * 1024
-    if total_bytes > max_bytes:
-        raise ValueError(f"Attachments too large: total {total_bytes} bytes exceeds limit {max_bytes} bytes")
-
-    msg = MIMEMultipart('mixed')
-    msg['From'] = args.get('from', 'me')
-    msg['To'] = ', '.join(to_list)
-    if args.get('cc'):
-        msg['Cc'] = ', '.join(args['cc'])
-    if args.get('bcc'):
-        msg['Bcc'] = ', '.join(args['bcc'])
-    msg['Subject'] = subject
-    if args.get('in_reply_to'):
-        msg['In-Reply-To'] = args['in_reply_to']
-        msg['References'] = args['in_reply_to']
-
-    body_text = args.get('body', '')
-    msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
-
-    for path in attachments:
-        ctype, _ = mimetypes.guess_type(path)
-        if not ctype:
-            ctype = 'application/octet-stream'
-        maintype, subtype = ctype.split('/', 1)
-        with open(path, 'rb') as f:
-            data = f.read()
-        part = MIMEBase(maintype, subtype)
-        part.set_payload(data)
-        encoders.encode_base64(part)
-        filename = os.path.basename(path)
-        # RFC2231 形式でUTF-8ファイル名を付与
-        part.add_header('Content-Disposition', 'attachment', filename=("utf-8", '', filename))
-        msg.attach(part)
-
-    return msg.as_string()
-    
+    opened: List[BinaryIO] = []
+    try:
+        for path in attachments:
+            f, size = _open_attachment(path)
+            opened.append(f)
+            total_bytes += size
+            if total_bytes > max_bytes:
+                raise ValueError(f"Attachments too large: total {total_bytes} bytes exceeds limit {max_bytes} bytes")
+        if len(opened) == 1:
+            # 1つだけなら buf に直接ストリーミングする
+            _write_attachment_header(buf, delimiter, attachments[0])
+            _write_base64_payload(buf, opened[0])
+        else:
+            # 複数ある場合は読み込みとエンコードをスレッドで並行させ、ディスクI/Oの待ち時間を重ねる
+            # 同時に保持するエンコード済みデータはワーカー数分までにし、書き込んだものから解放する
+            workers = min(8, len(opened))
+            pending: Deque[Tuple[str, "Future[bytearray]"]] = deque()
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                for path, f in zip(attachments, opened):
+                    pending.append((path, ex.submit(_encode_attachment, f)))
+                    if len(pending) >= workers:
+                        path_done, future = pending.popleft()
+                        _write_attachment_header(buf, delimiter, path_done)
+                        buf += future.result()
+                while pending:
+                    path_done, future = pending.popleft()
+                    _write_attachment_header(buf, delimiter, path_done)
+                    buf += future.result()
+    finally:
+        for f in opened:
+            f.close()
+
+    buf += f"--{boundary}--\r\n".encode("ascii")
+    return bytes(buf)
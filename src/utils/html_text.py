@@ -0,0 +1,28 @@
+"""
+html_text.py - HTMLメール本文からテキストを抽出する
+
+プロセスプールのワーカーから呼ばれるため、HTMLパーサ以外のモジュールはimportしない
+"""
+from bs4 import BeautifulSoup, SoupStrainer
+from selectolax.parser import HTMLParser
+
+# HTML本文から抽出する要素
+_BODY_STRAINER = SoupStrainer(["p", "div"])
+
+
+def extract_html_text(content: str) -> str:
+    """HTMLをパースして本文っぽい要素(p/div)のテキストだけ改行区切りで返す"""
+    try:
+        tree = HTMLParser(content)
+        # bs4 の get_text と同様に script/style/template の中身は本文に含めない
+        tree.strip_tags(["script", "style", "template"])
+        # css("p, div") はセレクタごとにまとめて返すため、文書順を保つようツリーを走査して拾う
+        main_texts = [
+            n.text(deep=True, strip=True)
+            for n in tree.root.traverse() if n.tag in ("p", "div")
+        ]
+    except Exception:
+        # selectolax で処理できない場合は BeautifulSoup(lxml) にフォールバック
+        soup = BeautifulSoup(content, "lxml", parse_only=_BODY_STRAINER)
+        main_texts = [p.get_text(strip=True) for p in soup.find_all(["p", "div"])]
+    return "\n".join(main_texts)
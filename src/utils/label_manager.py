@@ -1,11 +1,51 @@
-from typing import List, Optional, Dict, Any
+import time
+from typing import List, Optional, Dict, Any, Tuple
 from dataclasses import dataclass
 
 from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
 
 
-@dataclass
+# ラベル一覧キャッシュの有効期間(秒)
+_LABEL_INDEX_TTL = 60
+# (取得時刻, 小文字のラベル名 -> ラベル情報) の索引。list_labels で作成し、変更系の操作で破棄する
+_label_index: Optional[Tuple[float, Dict[str, Dict[str, Any]]]] = None
+
+
+def _invalidate_label_index() -> None:
+    """ラベル索引を破棄する"""
+    global _label_index
+    _label_index = None
+
+
+def _fetch_labels(service: Resource) -> Tuple[List[Dict[str, Any]], Tuple[float, Dict[str, Dict[str, Any]]]]:
+    """
+    全ラベルを取得し、名前検索用の索引を作成して登録する
+
+    Returns:
+        Tuple: (ラベルのリスト, 作成した索引)
+    """
+    global _label_index
+    try:
+        resp = service.users().labels().list(userId="me").execute()
+    except HttpError as error:
+        raise ValueError(f"Failed to list labels: {error}")
+    labels = resp.get("labels", [])
+    index = (time.monotonic(), {lbl["name"].lower(): lbl for lbl in labels})
+    _label_index = index
+    return labels, index
+
+
+def _get_label_index(service: Resource) -> Dict[str, Dict[str, Any]]:
+    """有効なラベル索引を返す。期限切れや未作成の場合は作り直す"""
+    index = _label_index
+    if index is None or time.monotonic() - index[0] > _LABEL_INDEX_TTL:
+        # 他スレッドから破棄される可能性があるため、グローバルを読み直さず作成した索引をそのまま使う
+        _, index = _fetch_labels(service)
+    return index[1]
+
+
+@dataclass(slots=True, frozen=True)
 class LabelColor:
     """
     Gmail ラベルの色設定を表すデータクラス。
@@ -18,7 +58,7 @@ class LabelColor:
     backgroundColor: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GmailLabel:
     """
     Gmail API の Label オブジェクトに対応したデータクラス。
@@ -42,6 +82,30 @@ class GmailLabel:
     messagesUnread: Optional[int] = None
     color: Optional[LabelColor] = None
 
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "GmailLabel":
+        """
+        Gmail API が返す Label の dict から GmailLabel を作成する
+
+        Args:
+            data: Gmail API の Label オブジェクト
+
+        Returns:
+            GmailLabel: 変換したインスタンス
+        """
+        c = data.get("color")
+        color = LabelColor(c.get("textColor"), c.get("backgroundColor")) if c else None
+        return cls(
+            id=data["id"],
+            name=data["name"],
+            type=data.get("type"),
+            messageListVisibility=data.get("messageListVisibility"),
+            labelListVisibility=data.get("labelListVisibility"),
+            messagesTotal=data.get("messagesTotal"),
+            messagesUnread=data.get("messagesUnread"),
+            color=color,
+        )
+
 
 def create_label(service: Resource,
                  label_name: str,
@@ -67,6 +131,7 @@ def create_label(service: Resource,
 
     try:
         label = service.users().labels().create(userId="me", body=body).execute()
+        _invalidate_label_index()
         return label
     except HttpError as error:
         msg = getattr(error, "error_details", str(error))
@@ -90,11 +155,12 @@ def update_label(service: Resource,
         Dict[str, Any]: 更新されたラベルの情報
     """
     try:
+        # 存在確認の get は行わず、update の 404 で判定する
         # パスパラメータとして渡すキーは id
-        service.users().labels().get(userId="me", id=label_id).execute()
         response = service.users().labels().update(
             userId="me", id=label_id, body=updates
         ).execute()
+        _invalidate_label_index()
         return response
     except HttpError as error:
         if error.status_code == 404:
@@ -114,16 +180,32 @@ def delete_label(service: Resource, label_id: str) -> Dict[str, Any]:
     Returns:
         Dict[str, Any]: 削除されたラベルの情報
     """
+    # get と delete を1回のバッチリクエストで送信してラウンドトリップを減らす
+    results: Dict[str, Any] = {}
+    def _collect(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=_collect)
+    batch.add(service.users().labels().get(userId="me", id=label_id), request_id="get")
+    batch.add(service.users().labels().delete(userId="me", id=label_id), request_id="delete")
     try:
-        data = service.users().labels().get(userId="me", id=label_id).execute()
-        if data.get("type") == "system":
-            raise ValueError(f"Cannot delete system label '{label_id}'")
-        service.users().labels().delete(userId="me", id=label_id).execute()
-        return {"success": True, "message": f"Label '{data.get('name')}' deleted successfully"}
+        batch.execute()
     except HttpError as error:
-        if error.status_code == 404:
-            raise ValueError(f"Label with ID '{label_id}' not found")
         raise ValueError(f"Failed to delete label: {error}")
+
+    data, _ = results.get("get", (None, None))
+    _, delete_error = results.get("delete", (None, None))
+    # システムラベルは Gmail 側でも削除が拒否される
+    if data and data.get("type") == "system":
+        raise ValueError(f"Cannot delete system label '{label_id}'")
+    if delete_error:
+        if isinstance(delete_error, HttpError) and delete_error.status_code == 404:
+            raise ValueError(f"Label with ID '{label_id}' not found")
+        raise ValueError(f"Failed to delete label: {delete_error}")
+    _invalidate_label_index()
+    # バッチ内の実行順は保証されないため、get が delete 後に処理された場合はIDで表示する
+    name = data.get("name") if data else label_id
+    return {"success": True, "message": f"Label '{name}' deleted successfully"}
     
 
 def list_labels(service: Resource) -> Dict[str, Any]:
@@ -136,26 +218,30 @@ def list_labels(service: Resource) -> Dict[str, Any]:
     Returns:
         Dict[str, Any]: ラベルのリスト
     """
-    try: 
-        resp = service.users().labels().list(userId="me").execute()
-        labels = resp.get("labels", [])
-        system = [lbl for lbl in labels if lbl.get("type") == "system"]
-        user = [lbl for lbl in labels if lbl.get("type") == "user"]
-        return {
-            "all": labels,
-            "system": system,
-            "user": user,
-            "count": {
-                "total": len(labels),
-                "system": len(system),
-                "user": len(user),
-            },
-        }
-    except HttpError as error:
-        raise ValueError(f"Failed to list labels: {error}")
+    # 取得と同時に名前検索用の索引も作成される
+    labels, _ = _fetch_labels(service)
+    # 1回の走査でシステム/ユーザーラベルに振り分ける
+    system: List[Dict[str, Any]] = []
+    user: List[Dict[str, Any]] = []
+    for lbl in labels:
+        label_type = lbl.get("type")
+        if label_type == "system":
+            system.append(lbl)
+        elif label_type == "user":
+            user.append(lbl)
+    return {
+        "all": labels,
+        "system": system,
+        "user": user,
+        "count": {
+            "total": len(labels),
+            "system": len(system),
+            "user": len(user),
+        },
+    }
     
 
-def find_label_by_name(service: Resource, label_name: str) -> Optional[GmailLabel]:
+def find_label_by_name(service: Resource, label_name: str, refresh: bool = False) -> Optional[GmailLabel]:
     """
     名前でラベルを検索し、見つかればそのラベルのGmailLabelインスタンスを返す(大文字小文字の区別はしない)
     見つからない場合はNoneを返す
@@ -163,29 +249,18 @@ def find_label_by_name(service: Resource, label_name: str) -> Optional[GmailLabe
     Args:
         service: Google APIのResourceオブジェクト
         label_name: 検索するラベルの名前
+        refresh: Trueの場合は索引を使わずにラベル一覧を取り直して検索する
 
     Returns:
         Optional[GmailLabel]: 見つかったラベルのインスタンス、見つからない場合はNone
     """
-    raw = list_labels(service)["all"]
-    for data in raw:
-        if data.get("name", "").lower() == label_name.lower():
-            color_data = data.get("color", {})
-            color = LabelColor(
-                textColor=color_data.get("textColor"),
-                backgroundColor=color_data.get("backgroundColor"),
-            ) if color_data else None
-            return GmailLabel(
-                id=data.get("id"),
-                name=data["name"],
-                type=data.get("type"),
-                messageListVisibility=data.get("messageListVisibility"),
-                labelListVisibility=data.get("labelListVisibility"),
-                messagesTotal=data.get("messagesTotal"),
-                messagesUnread=data.get("messagesUnread"),
-                color=color,
-            )
-    return None
+    if refresh:
+        # 取り直した一覧で索引も作り直される
+        _, (_, index) = _fetch_labels(service)
+    else:
+        index = _get_label_index(service)
+    data = index.get(label_name.lower())
+    return GmailLabel.from_api(data) if data else None
 
 
 def get_or_create_label(service: Resource,
@@ -210,18 +285,4 @@ def get_or_create_label(service: Resource,
         return existing
     raw = create_label(service, label_name, message_list_visibility, label_list_visibility)
     # create_label の戻り値が dict なので GmailLabel に変換
-    color_data = raw.get("color", {})
-    color = LabelColor(
-        textColor=color_data.get("textColor"),
-        backgroundColor=color_data.get("backgroundColor"),
-    ) if color_data else None
-    return GmailLabel(
-        id=raw.get("id"),
-        name=raw.get("name"),
-        type=raw.get("type"),
-        messageListVisibility=raw.get("messageListVisibility"),
-        labelListVisibility=raw.get("labelListVisibility"),
-        messagesTotal=raw.get("messagesTotal"),
-        messagesUnread=raw.get("messagesUnread"),
-        color=color,
-    )
+    return GmailLabel.from_api(raw)
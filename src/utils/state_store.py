@@ -0,0 +1,51 @@
+"""
+state_store.py - OAuthトークンを保持するSQLiteストア
+
+MCPクライアントからサーバーが頻繁に再起動されても、
+1つのDBファイルから起動に必要な状態を読み込めるようにする
+"""
+import sqlite3
+from contextlib import closing
+from typing import List, Optional
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """DBに接続し、必要なテーブルがなければ作成する"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS creds (scope TEXT PRIMARY KEY, token BLOB)")
+    return conn
+
+
+def _scope_key(scopes: List[str]) -> str:
+    """スコープの組をキーに変換する(順序に依存しない)"""
+    return " ".join(sorted(scopes))
+
+
+def load_token(db_path: str, scopes: List[str]) -> Optional[str]:
+    """
+    指定スコープのトークン情報(authorized user JSON)を取得する
+
+    Returns:
+        Optional[str]: 保存済みのJSON文字列、なければNone
+    """
+    # sqlite3.Connection の with はトランザクションのみを扱うため、closing で確実に閉じる
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT token FROM creds WHERE scope = ?", (_scope_key(scopes),)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def save_token(db_path: str, scopes: List[str], token: str) -> None:
+    """指定スコープのトークン情報を保存する"""
+    with closing(_connect(db_path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO creds (scope, token) VALUES (?, ?)",
+            (_scope_key(scopes), token)
+        )
+
+
+def delete_token(db_path: str, scopes: List[str]) -> None:
+    """指定スコープのトークン情報を削除する"""
+    with closing(_connect(db_path)) as conn, conn:
+        conn.execute("DELETE FROM creds WHERE scope = ?", (_scope_key(scopes),))
@@ -1,6 +1,7 @@
 import base64
+from typing import Union
 
-def decode_base64url(data: str) -> str:
+def decode_base64url(data: Union[str, bytes]) -> str:
     """
     Base64URL形式の文字列をUTF-8の文字列に変換する
 
@@ -10,7 +11,7 @@ def decode_base64url(data: str) -> str:
     不足している「=」を自動的に追加し、安全にデコードを行う。
 
     Args:
-        data (str): パディングの省略されたBase64URL形式の文字列
+        data (Union[str, bytes]): パディングの省略されたBase64URL形式の文字列(またはASCIIバイト列)
 
     Returns:
         str: UTF-8でデコードされた文字列（メール本文など）
@@ -19,5 +20,8 @@ def decode_base64url(data: str) -> str:
         UnicodeDecodeError: デコード結果がUTF-8として不正な場合
         binascii.Error: 入力がBase64として不正な場合
     """
-    padding = "=" * (-len(data) % 4)
-    return base64.urlsafe_b64decode(data + padding).decode("utf-8")
\ No newline at end of file
+    if isinstance(data, str):
+        # 先にバイト列にしておき、パディング付与とデコードをバイト列のまま行う
+        data = data.encode("ascii")
+    pad = -len(data) & 3
+    return base64.urlsafe_b64decode(data + b"=" * pad).decode("utf-8")
\ No newline at end of file